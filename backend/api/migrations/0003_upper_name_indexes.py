@@ -0,0 +1,44 @@
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_price_competitor_brand_price_competitor_country'),
+    ]
+
+    # products/aggregators are unmanaged, so AddIndex alone would only touch
+    # the migration state; the indexes themselves are created with RunSQL.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='aggregator',
+                    index=models.Index(django.db.models.functions.text.Upper('name'), name='aggregator_name_upper_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='product',
+                    index=models.Index(django.db.models.functions.text.Upper('name'), name='product_name_upper_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='product',
+                    index=models.Index(django.db.models.functions.text.Upper('sku'), name='product_sku_upper_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX IF NOT EXISTS aggregator_name_upper_idx ON aggregators (UPPER(name));',
+                    'DROP INDEX IF EXISTS aggregator_name_upper_idx;',
+                ),
+                migrations.RunSQL(
+                    'CREATE INDEX IF NOT EXISTS product_name_upper_idx ON products (UPPER(name));',
+                    'DROP INDEX IF EXISTS product_name_upper_idx;',
+                ),
+                migrations.RunSQL(
+                    'CREATE INDEX IF NOT EXISTS product_sku_upper_idx ON products (UPPER(sku));',
+                    'DROP INDEX IF EXISTS product_sku_upper_idx;',
+                ),
+            ],
+        ),
+    ]
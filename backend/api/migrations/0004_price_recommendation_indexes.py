@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_upper_name_indexes'),
+    ]
+
+    # (product, aggregator) on prices is already covered by the unique_together
+    # index. recommendations is unmanaged, so its indexes are created with RunSQL.
+    operations = [
+        migrations.AddIndex(
+            model_name='price',
+            index=models.Index(fields=['product', 'is_available'], name='price_product_available_idx'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='recommendation',
+                    index=models.Index(fields=['product', 'status'], name='rec_product_status_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='recommendation',
+                    index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['product'], name='rec_pending_product_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX IF NOT EXISTS rec_product_status_idx ON recommendations (product_id, status);',
+                    'DROP INDEX IF EXISTS rec_product_status_idx;',
+                ),
+                migrations.RunSQL(
+                    "CREATE INDEX IF NOT EXISTS rec_pending_product_idx ON recommendations (product_id) WHERE status = 'PENDING';",
+                    'DROP INDEX IF EXISTS rec_pending_product_idx;',
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_price_recommendation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlgoRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watermark', models.DateTimeField(db_index=True)),
+                ('new_recommendations', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'algo_runs',
+            },
+        ),
+    ]
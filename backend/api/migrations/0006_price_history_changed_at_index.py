@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_algorun'),
+    ]
+
+    # price_history is unmanaged, so the index is created with RunSQL.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='pricehistory',
+                    index=models.Index(fields=['-changed_at'], name='price_history_changed_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX IF NOT EXISTS price_history_changed_idx ON price_history (changed_at DESC);',
+                    'DROP INDEX IF EXISTS price_history_changed_idx;',
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_price_history_changed_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='price',
+            index=models.Index(condition=models.Q(('is_available', True), ('price__isnull', False)), fields=['product', 'aggregator'], name='price_avail_idx'),
+        ),
+    ]
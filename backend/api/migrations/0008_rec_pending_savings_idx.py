@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_price_avail_idx'),
+    ]
+
+    # recommendations is unmanaged, so the index is created with RunSQL.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='recommendation',
+                    index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['potential_savings'], name='rec_pending_savings_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    "CREATE INDEX IF NOT EXISTS rec_pending_savings_idx ON recommendations (potential_savings) "
+                    "WHERE status = 'PENDING';",
+                    'DROP INDEX IF EXISTS rec_pending_savings_idx;',
+                ),
+            ],
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Upper
 
 
 class Aggregator(models.Model):
@@ -11,6 +13,9 @@ class Aggregator(models.Model):
     class Meta:
         db_table = 'aggregators'
         managed = False
+        indexes = [
+            models.Index(Upper('name'), name='aggregator_name_upper_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -30,11 +35,29 @@ class Category(models.Model):
         return self.name
 
     def get_descendants(self):
-        """Получить все дочерние категории рекурсивно"""
-        descendants = list(self.children.all())
-        for child in self.children.all():
-            descendants.extend(child.get_descendants())
-        return descendants
+        """Получить все дочерние категории рекурсивно (один запрос, любой глубины)"""
+        table = self._meta.db_table
+        # UNION (а не UNION ALL) не даёт зациклиться, если в parent_id есть цикл
+        categories = Category.objects.raw(
+            f'WITH RECURSIVE tree(id) AS ('
+            f'SELECT id FROM {table} WHERE parent_id = %s '
+            f'UNION '
+            f'SELECT c.id FROM {table} c JOIN tree t ON c.parent_id = t.id'
+            f') SELECT * FROM {table} WHERE id IN (SELECT id FROM tree) ORDER BY id',
+            [self.pk]
+        )
+        children = {}
+        for category in categories:
+            children.setdefault(category.parent_id, []).append(category)
+
+        # Порядок как у прежней рекурсии: сначала дети, затем потомки каждого ребёнка
+        def collect(parent_id):
+            descendants = children.pop(parent_id, [])
+            for child in list(descendants):
+                descendants.extend(collect(child.pk))
+            return descendants
+
+        return collect(self.pk)
 
 
 class Product(models.Model):
@@ -59,6 +82,10 @@ class Product(models.Model):
     class Meta:
         db_table = 'products'
         managed = False
+        indexes = [
+            models.Index(Upper('name'), name='product_name_upper_idx'),
+            models.Index(Upper('sku'), name='product_sku_upper_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -96,6 +123,14 @@ class Price(models.Model):
     class Meta:
         db_table = 'prices'
         unique_together = ('product', 'aggregator')
+        indexes = [
+            models.Index(fields=['product', 'is_available'], name='price_product_available_idx'),
+            models.Index(
+                fields=['product', 'aggregator'],
+                condition=Q(is_available=True, price__isnull=False),
+                name='price_avail_idx'
+            ),
+        ]
 
 
 class Recommendation(models.Model):
@@ -128,6 +163,15 @@ class Recommendation(models.Model):
     class Meta:
         db_table = 'recommendations'
         managed = False
+        indexes = [
+            models.Index(fields=['product', 'status'], name='rec_product_status_idx'),
+            models.Index(fields=['product'], condition=Q(status='PENDING'), name='rec_pending_product_idx'),
+            models.Index(
+                fields=['potential_savings'],
+                condition=Q(status='PENDING'),
+                name='rec_pending_savings_idx'
+            ),
+        ]
 
 
 class PriceHistory(models.Model):
@@ -140,6 +184,9 @@ class PriceHistory(models.Model):
     class Meta:
         db_table = 'price_history'
         managed = False
+        indexes = [
+            models.Index(fields=['-changed_at'], name='price_history_changed_idx'),
+        ]
 
 
 class ProductLink(models.Model):
@@ -201,3 +248,16 @@ class ImportJob(models.Model):
 
     def __str__(self):
         return f"{self.job_type} - {self.status}"
+
+
+class AlgoRun(models.Model):
+    """Запуск алгоритма: watermark — момент, с которого считаются изменения цен для следующего запуска"""
+    watermark = models.DateTimeField(db_index=True)
+    new_recommendations = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'algo_runs'
+
+    def __str__(self):
+        return f"{self.watermark} - {self.new_recommendations}"
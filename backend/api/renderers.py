@@ -0,0 +1,31 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSON renderer backed by orjson, falls back to the stock renderer if it is not installed.
+
+    Only compact output goes through orjson: when an indent is requested
+    (browsable API, ``Accept: application/json; indent=4``) the stock
+    renderer is used. Datetimes and anything orjson can't encode natively
+    go through DRF's JSONEncoder, and U+2028/U+2029 are escaped the same
+    way JSONRenderer does it.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        ret = orjson.dumps(
+            data,
+            default=JSONEncoder().default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+        # Valid JSON but not valid JavaScript, escape them like JSONRenderer
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
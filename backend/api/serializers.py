@@ -1,3 +1,4 @@
+from django.db.models import Min, OuterRef, Prefetch, Subquery
 from rest_framework import serializers
 from .models import Aggregator, Category, Product, Price, Recommendation, PriceHistory, ProductLink, UnitConversion, ImportJob
 
@@ -24,14 +25,18 @@ class CategoryTreeSerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', 'icon', 'sort_order', 'children', 'product_count']
 
+    # Дерево собирается в памяти: context['children'] — {parent_id: [дети по порядку]},
+    # context['product_counts'] — {category_id: число товаров}
+
     def get_children(self, obj):
-        children = obj.children.all().order_by('sort_order', 'name')
-        return CategoryTreeSerializer(children, many=True).data
+        children = self.context['children'].get(obj.id, [])
+        return CategoryTreeSerializer(children, many=True, context=self.context).data
 
     def get_product_count(self, obj):
-        count = Product.objects.filter(category=obj).count()
-        for child in obj.children.all():
-            count += Product.objects.filter(category=child).count()
+        counts = self.context['product_counts']
+        count = counts.get(obj.id, 0)
+        for child in self.context['children'].get(obj.id, []):
+            count += counts.get(child.id, 0)
         return count
 
 
@@ -85,6 +90,27 @@ class ProductComparisonSerializer(serializers.ModelSerializer):
             'min_competitor_price', 'status', 'recommended_price'
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Prefetch prices/links and annotate the prices the comparison fields are built from"""
+        available = Price.objects.filter(product=OuterRef('pk'), is_available=True)
+        competitors = available.filter(aggregator__is_our_company=False)
+        return queryset.prefetch_related(
+            Prefetch('price_set', queryset=Price.objects.select_related('aggregator')),
+            'links'
+        ).annotate(
+            our_price=Subquery(
+                available.filter(aggregator__is_our_company=True, price__gt=0).values('price')[:1]
+            ),
+            # Лучшая цена конкурента для статуса/позиции (нулевые цены не считаются)
+            best_competitor_price=Subquery(
+                competitors.filter(price__gt=0).values('product').annotate(m=Min('price')).values('m')
+            ),
+            min_competitor_price=Subquery(
+                competitors.filter(price__isnull=False).values('product').annotate(m=Min('price')).values('m')
+            )
+        )
+
     def get_weight_info(self, obj):
         if obj.weight_value and obj.weight_unit:
             return {
@@ -95,8 +121,8 @@ class ProductComparisonSerializer(serializers.ModelSerializer):
         return None
 
     def get_prices(self, obj):
-        prices = Price.objects.filter(product=obj).select_related('aggregator')
-        links = {link.aggregator_id: link for link in ProductLink.objects.filter(product=obj)}
+        prices = obj.price_set.all()
+        links = {link.aggregator_id: link for link in obj.links.all()}
         result = {}
         for price in prices:
             link = links.get(price.aggregator_id)
@@ -115,7 +141,7 @@ class ProductComparisonSerializer(serializers.ModelSerializer):
         if not obj.weight_value or not obj.weight_unit:
             return None
 
-        prices = Price.objects.filter(product=obj).select_related('aggregator')
+        prices = obj.price_set.all()
         result = {}
 
         # Определяем стандартную единицу и множитель
@@ -149,44 +175,29 @@ class ProductComparisonSerializer(serializers.ModelSerializer):
         TOP 1 только если наша цена СТРОГО меньше всех конкурентов.
         Равная цена = нужно снизить на 1₸
         """
-        prices = Price.objects.filter(product=obj).select_related('aggregator')
-        our_price = None
-        competitor_prices = []
-
-        for price in prices:
-            if price.price and price.is_available:
-                if price.aggregator.is_our_company:
-                    our_price = float(price.price)
-                else:
-                    competitor_prices.append(float(price.price))
-
-        if our_price is None:
+        if obj.our_price is None:
             return None  # Нет нашего товара
 
-        if not competitor_prices:
+        if obj.best_competitor_price is None:
             return 1  # Нет конкурентов - мы единственные
 
-        min_competitor = min(competitor_prices)
-
         # TOP 1 только если СТРОГО меньше
-        if our_price < min_competitor:
+        if obj.our_price < obj.best_competitor_price:
             return 1
-        elif our_price == min_competitor:
+        elif obj.our_price == obj.best_competitor_price:
             return 2  # Равная цена - не лидер
         else:
             # Считаем позицию
-            all_prices = sorted(set(competitor_prices + [our_price]))
-            return all_prices.index(our_price) + 1
+            competitor_prices = [
+                price.price for price in obj.price_set.all()
+                if price.price and price.is_available and not price.aggregator.is_our_company
+            ]
+            all_prices = sorted(set(competitor_prices + [obj.our_price]))
+            return all_prices.index(obj.our_price) + 1
 
     def get_min_competitor_price(self, obj):
-        prices = Price.objects.filter(
-            product=obj,
-            aggregator__is_our_company=False,
-            is_available=True
-        ).exclude(price__isnull=True)
-
-        if prices.exists():
-            return float(min(p.price for p in prices))
+        if obj.min_competitor_price is not None:
+            return float(obj.min_competitor_price)
         return None
 
     def get_status(self, obj):
@@ -197,28 +208,15 @@ class ProductComparisonSerializer(serializers.ModelSerializer):
         - 'higher' - наша цена выше, нужно снизить
         - 'missing' - у нас нет этого товара
         """
-        prices = Price.objects.filter(product=obj).select_related('aggregator')
-        our_price = None
-        competitor_prices = []
-
-        for price in prices:
-            if price.price and price.is_available:
-                if price.aggregator.is_our_company:
-                    our_price = float(price.price)
-                else:
-                    competitor_prices.append(float(price.price))
-
-        if our_price is None:
+        if obj.our_price is None:
             return 'missing'
 
-        if not competitor_prices:
+        if obj.best_competitor_price is None:
             return 'top'
 
-        min_competitor = min(competitor_prices)
-
-        if our_price < min_competitor:
+        if obj.our_price < obj.best_competitor_price:
             return 'top'
-        elif our_price == min_competitor:
+        elif obj.our_price == obj.best_competitor_price:
             return 'equal'
         else:
             return 'higher'
@@ -260,3 +258,7 @@ class DashboardSerializer(serializers.Serializer):
     potential_savings = serializers.DecimalField(max_digits=10, decimal_places=2)
     market_coverage = serializers.FloatField()
     price_competitiveness = serializers.FloatField()
+
+
+class ApplyBulkSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
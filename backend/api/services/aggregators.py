@@ -0,0 +1,26 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from ..models import Aggregator
+
+OUR_AGGREGATOR_CACHE_KEY = 'our_aggregator_id'
+OUR_AGGREGATOR_CACHE_TIMEOUT = 3600
+
+
+def get_our_aggregator_id():
+    """Primary key of our own aggregator.
+
+    Only the id is cached so callers never hold a stale instance. It is kept
+    in Django's cache rather than a per-process memo: with a shared backend
+    every worker sees the signal-driven invalidation, otherwise the TTL
+    bounds how long a worker can lag behind.
+    """
+    return cache.get_or_set(OUR_AGGREGATOR_CACHE_KEY, _load_our_aggregator_id, OUR_AGGREGATOR_CACHE_TIMEOUT)
+
+
+def invalidate_our_aggregator_id():
+    transaction.on_commit(lambda: cache.delete(OUR_AGGREGATOR_CACHE_KEY))
+
+
+def _load_our_aggregator_id():
+    return Aggregator.objects.filter(is_our_company=True).values_list('id', flat=True).first()
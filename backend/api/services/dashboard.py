@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Min, Q, Sum
+
+from ..models import Price, Product, Recommendation
+
+DASHBOARD_CACHE_KEY = 'dashboard_stats'
+DASHBOARD_CACHE_TIMEOUT = 300
+
+
+def get_dashboard_stats():
+    """Dashboard counters, cached until prices, products or recommendations change"""
+    return cache.get_or_set(DASHBOARD_CACHE_KEY, compute_dashboard_stats, DASHBOARD_CACHE_TIMEOUT)
+
+
+def invalidate_dashboard_stats():
+    """Drop cached counters; call after bulk writes that bypass model signals.
+
+    Deferred until the surrounding transaction commits, otherwise a request
+    in between could cache the counters computed from uncommitted data.
+    """
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_CACHE_KEY))
+
+
+def compute_dashboard_stats():
+    total_products = Product.objects.count()
+
+    # Our price and the best competitor price per product, counted in the same query
+    price_summary = Price.objects.filter(
+        is_available=True,
+        price__gt=0
+    ).values('product_id').annotate(
+        our_price=Min('price', filter=Q(aggregator__is_our_company=True)),
+        min_competitor=Min('price', filter=Q(aggregator__is_our_company=False))
+    ).aggregate(
+        with_our_price=Count('product_id', filter=Q(our_price__isnull=False)),
+        # TOP 1 только если СТРОГО меньше
+        at_top=Count('product_id', filter=Q(our_price__lt=F('min_competitor'))),
+        # Равная цена или выше = нужно действие
+        need_action=Count('product_id', filter=Q(our_price__gte=F('min_competitor')))
+    )
+
+    products_at_top = price_summary['at_top']
+    products_need_action = price_summary['need_action']
+    missing_products = total_products - price_summary['with_our_price']
+
+    pending = Recommendation.objects.filter(status='PENDING').aggregate(
+        count=Count('id'),
+        savings=Sum('potential_savings')
+    )
+    pending_recommendations = pending['count']
+    potential_savings = pending['savings'] or Decimal('0')
+
+    market_coverage = ((total_products - missing_products) / total_products * 100) if total_products > 0 else 0
+    price_competitiveness = (products_at_top / (total_products - missing_products) * 100) if (total_products - missing_products) > 0 else 0
+
+    data = {
+        'total_products': total_products,
+        'products_at_top': products_at_top,
+        'products_need_action': products_need_action,
+        'missing_products': missing_products,
+        'pending_recommendations': pending_recommendations,
+        'potential_savings': potential_savings,
+        'market_coverage': round(market_coverage, 1),
+        'price_competitiveness': round(price_competitiveness, 1)
+    }
+
+    return data
@@ -0,0 +1,24 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from ..models import PriceHistory
+from ..serializers import PriceHistorySerializer
+
+PRICE_HISTORY_CACHE_KEY = 'price_history:last50'
+PRICE_HISTORY_CACHE_TIMEOUT = 30
+
+
+def get_recent_price_history():
+    """Last 50 serialized price changes, cached for a short time"""
+    return cache.get_or_set(PRICE_HISTORY_CACHE_KEY, _serialize_recent, PRICE_HISTORY_CACHE_TIMEOUT)
+
+
+def invalidate_price_history():
+    """Drop the cached list once the current transaction commits"""
+    transaction.on_commit(lambda: cache.delete(PRICE_HISTORY_CACHE_KEY))
+
+
+def _serialize_recent():
+    history = PriceHistory.objects.all().select_related('product', 'aggregator').order_by('-changed_at')[:50]
+    # Plain list: ReturnList would drag the serializer into the cache pickle
+    return list(PriceHistorySerializer(history, many=True).data)
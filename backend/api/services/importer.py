@@ -1,8 +1,58 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+import openpyxl
 import pandas as pd
 import io
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from django.db import DatabaseError, connection, transaction
+from django.db.models.functions import Upper
 from django.utils import timezone
 from ..models import Category, Product, Price, Aggregator, ProductLink
+from .dashboard import invalidate_dashboard_stats
+
+logger = logging.getLogger(__name__)
+
+# Rows per chunk when streaming CSV files
+CSV_CHUNK_SIZE = 10_000
+
+# Errors kept on the job itself; the rest only go to the error log file
+MAX_ERROR_DETAILS = 1000
+
+# Error log files older than this (in seconds) are removed when the next import starts
+ERROR_LOG_MAX_AGE = 7 * 24 * 3600
+
+# Rows per bulk statement when flushing queued objects
+BULK_BATCH_SIZE = 5000
+
+# Columns refreshed when an imported product/price/link already exists
+PRODUCT_UPDATE_FIELDS = [
+    'category', 'brand', 'manufacturer', 'country_of_origin',
+    'weight_value', 'weight_unit', 'sku', 'image_url',
+]
+PRICE_UPDATE_FIELDS = ['price', 'is_available', 'competitor_brand', 'competitor_country', 'last_updated']
+LINK_UPDATE_FIELDS = ['url', 'external_name']
+
+# Columns holding the product reference (name or SKU) in price/link files
+PRICE_PRODUCT_KEYS = ('product_name_or_sku', 'product', 'товар', 'name', 'sku')
+LINK_PRODUCT_KEYS = ('product_name_or_sku', 'product', 'товар', 'name')
+
+
+def _to_decimal(value):
+    """Convert a cell value to Decimal without a str() round-trip; None if empty or invalid"""
+    if not value:
+        return None
+    try:
+        if isinstance(value, float):
+            # repr gives the shortest exact form, e.g. 0.1 -> '0.1'
+            return Decimal(repr(value))
+        return Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
 
 class DataImporter:
     def __init__(self, job):
@@ -10,50 +60,70 @@ class DataImporter:
         self.errors = []
         self.success_count = 0
         self.processed_rows = 0
+        self._col_pos = {}
+        # Alias tuple -> resolved column position, filled once per frame
+        self._key_pos = {}
+        self.error_log_path = os.path.join(tempfile.gettempdir(), f'import_{job.id}_errors.jsonl')
+        self._error_log = None
+        # name or (product_id, aggregator_id) -> (row, unsaved object); last row wins
+        self._pending_products = {}
+        self._pending_prices = {}
+        self._pending_links = {}
+        # Lookup caches: there are only a handful of aggregators/categories per file
+        self._aggregators = {}
+        self._categories = {}
+        # Product reference -> product id (or None), resolved once per distinct value
+        self._products = {}
 
     def process(self, file):
+        self._remove_stale_error_logs()
         try:
-            # Determine file type and read
-            if file.name.endswith('.xlsx'):
-                df = pd.read_excel(file)
-            elif file.name.endswith('.csv'):
-                df = pd.read_csv(file)
-            else:
-                raise ValueError("Unsupported file format. Please use .xlsx or .csv")
+            self.job.total_rows = 0
 
-            # Standardize column names (lowercase, strip)
-            df.columns = [str(col).strip().lower() for col in df.columns]
-            
-            # Fill NaN
-            df = df.fillna('')
+            for df in self._read_frames(file):
+                # Standardize column names (lowercase, strip)
+                df.columns = [str(col).strip().lower() for col in df.columns]
 
-            self.job.total_rows = len(df)
-            self.job.save()
+                # Fill NaN
+                df = df.fillna('')
+
+                self.job.total_rows += len(df)
+                self.job.save()
+
+                # Positions of columns inside itertuples rows (0 is the index)
+                self._col_pos = {col: i + 1 for i, col in enumerate(df.columns)}
+                self._key_pos = {}
+
+                if self.job.job_type in ('prices', 'links'):
+                    keys = PRICE_PRODUCT_KEYS if self.job.job_type == 'prices' else LINK_PRODUCT_KEYS
+                    self._prefetch_products(
+                        self._get_val(row, keys) for row in df.itertuples(index=True, name=None)
+                    )
+
+                # One transaction per chunk instead of a commit per row;
+                # update_or_create/get_or_create keep their own savepoints
+                with transaction.atomic():
+                    for row in df.itertuples(index=True, name=None):
+                        try:
+                            if self.job.job_type == 'products':
+                                self._process_product(row)
+                            elif self.job.job_type == 'prices':
+                                self._process_price(row)
+                            elif self.job.job_type == 'links':
+                                self._process_link(row)
+                            elif self.job.job_type == 'categories':
+                                self._process_category(row)
 
-            for index, row in df.iterrows():
-                try:
-                    if self.job.job_type == 'products':
-                        self._process_product(row)
-                    elif self.job.job_type == 'prices':
-                        self._process_price(row)
-                    elif self.job.job_type == 'links':
-                        self._process_link(row)
-                    elif self.job.job_type == 'categories':
-                        self._process_category(row)
-                    
-                    self.success_count += 1
-                except Exception as e:
-                    self.errors.append({
-                        'row': index + 2, # 1-based + header
-                        'error': str(e),
-                        'data': row.to_dict()
-                    })
-                    self.job.error_count += 1
-                
-                self.processed_rows += 1
-                if self.processed_rows % 10 == 0:
-                    self.job.processed_rows = self.processed_rows
-                    self.job.save()
+                            self.success_count += 1
+                        except Exception as e:
+                            self._record_error(row, e)
+
+                        self.processed_rows += 1
+
+                    self._flush()
+
+                self.job.processed_rows = self.processed_rows
+                self.job.save()
 
             self.job.status = 'completed'
             self.job.error_details = self.errors if self.errors else None
@@ -63,134 +133,333 @@ class DataImporter:
             self.job.save()
 
         except Exception as e:
+            logger.warning("Import job %s failed: %s", self.job.id, e)
             self.job.status = 'failed'
             self.job.error_details = {'error': str(e)}
             self.job.completed_at = timezone.now()
             self.job.save()
 
+        finally:
+            if self._error_log:
+                self._error_log.close()
+                logger.info("Import job %s: %s failed rows written to %s",
+                            self.job.id, self.job.error_count, self.error_log_path)
+            # Bulk writes skip model signals; committed chunks may have changed the counters
+            invalidate_dashboard_stats()
+
+    @staticmethod
+    def _remove_stale_error_logs():
+        """Delete error logs of earlier imports once they exceed ERROR_LOG_MAX_AGE"""
+        cutoff = time.time() - ERROR_LOG_MAX_AGE
+        for path in glob.glob(os.path.join(tempfile.gettempdir(), 'import_*_errors.jsonl')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _record_error(self, row, error):
+        """Keep a short summary in memory and write the full row to the error log"""
+        row_number = row[0] + 2 # 1-based + header
+        if len(self.errors) < MAX_ERROR_DETAILS:
+            self.errors.append({'row': row_number, 'error': str(error)})
+
+        if self._error_log is None:
+            self._error_log = open(self.error_log_path, 'w', encoding='utf-8')
+        self._error_log.write(json.dumps({
+            'row': row_number,
+            'error': str(error),
+            'data': dict(zip(self._col_pos, row[1:]))
+        }, ensure_ascii=False, default=str) + '\n')
+
+        self.job.error_count += 1
+
+    def _flush(self):
+        """Write queued objects in bulk, falling back to row-by-row on failure"""
+        if self._pending_products:
+            self._flush_products()
+
+        for model, pending, update_fields in (
+            (Price, self._pending_prices, PRICE_UPDATE_FIELDS),
+            (ProductLink, self._pending_links, LINK_UPDATE_FIELDS),
+        ):
+            if not pending:
+                continue
+            entries = list(pending.values())
+            pending.clear()
+
+            try:
+                # Savepoint, so a rejected batch does not abort the chunk transaction
+                with transaction.atomic():
+                    model.objects.bulk_create(
+                        [obj for _, obj in entries],
+                        batch_size=BULK_BATCH_SIZE,
+                        update_conflicts=True,
+                        unique_fields=['product', 'aggregator'],
+                        update_fields=update_fields,
+                    )
+            except DatabaseError:
+                self._save_one_by_one(model, entries, ['product_id', 'aggregator_id'], update_fields)
+
+    def _flush_products(self):
+        """Create new products and update existing ones (matched by exact name) in bulk"""
+        entries = list(self._pending_products.values())
+        self._pending_products.clear()
+
+        # products.name has no unique constraint, so match existing rows explicitly
+        names = [obj.name for _, obj in entries]
+        existing = {}
+        for start in range(0, len(names), BULK_BATCH_SIZE):
+            for product_id, name in Product.objects.filter(
+                name__in=names[start:start + BULK_BATCH_SIZE]
+            ).values_list('id', 'name'):
+                existing.setdefault(name, []).append(product_id)
+
+        to_create, to_update = [], []
+        for row, obj in entries:
+            ids = existing.get(obj.name)
+            if not ids:
+                to_create.append((row, obj))
+            elif len(ids) > 1:
+                self.success_count -= 1
+                self._record_error(row, Product.MultipleObjectsReturned(f"Multiple products named {obj.name}"))
+            else:
+                obj.pk = ids[0]
+                to_update.append((row, obj))
+
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create([obj for _, obj in to_create], batch_size=BULK_BATCH_SIZE)
+                Product.objects.bulk_update([obj for _, obj in to_update], PRODUCT_UPDATE_FIELDS, batch_size=BULK_BATCH_SIZE)
+        except DatabaseError:
+            self._save_one_by_one(Product, to_create + to_update, ['name'], PRODUCT_UPDATE_FIELDS)
+
+    def _save_one_by_one(self, model, entries, lookup_fields, update_fields):
+        """Fallback for a rejected bulk write: save rows individually to find the bad ones"""
+        for row, obj in entries:
+            try:
+                model.objects.update_or_create(
+                    **{field: getattr(obj, field) for field in lookup_fields},
+                    defaults={field: getattr(obj, field) for field in update_fields if field != 'last_updated'}
+                )
+            except Exception as e:
+                self.success_count -= 1
+                self._record_error(row, e)
+
+    def _read_frames(self, file):
+        """Read the file as a sequence of DataFrames; CSV is streamed in chunks"""
+        if file.name.endswith('.xlsx'):
+            yield from self._read_xlsx(file)
+        elif file.name.endswith('.csv'):
+            # Index continues across chunks, so row numbers stay file-wide
+            yield from pd.read_csv(file, chunksize=CSV_CHUNK_SIZE, dtype=str, keep_default_na=False)
+        else:
+            raise ValueError("Unsupported file format. Please use .xlsx or .csv")
+
+    def _read_xlsx(self, file):
+        """Stream the first sheet in CSV_CHUNK_SIZE frames without loading the whole workbook"""
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            # Read-only mode trusts the <dimension> tag, which many exporters get wrong
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [f'Unnamed: {i}' if col is None else col for i, col in enumerate(header)]
+
+            chunk, blanks, start = [], [], 0
+            for values in rows:
+                # Trailing empty rows are dropped like read_excel does; inner ones keep their row number
+                if all(v is None for v in values):
+                    blanks.append(values)
+                    continue
+                chunk.extend(blanks)
+                blanks = []
+                chunk.append(values)
+                # Without a trusted dimension rows can be wider than the header
+                width = max(i for i, v in enumerate(values) if v is not None) + 1
+                columns.extend(f'Unnamed: {i}' for i in range(len(columns), width))
+                if len(chunk) >= CSV_CHUNK_SIZE:
+                    yield self._frame(chunk, columns, start)
+                    start += len(chunk)
+                    chunk = []
+            if chunk:
+                yield self._frame(chunk, columns, start)
+        finally:
+            workbook.close()
+
+    def _frame(self, rows, columns, start):
+        # Short rows are padded, the index continues across chunks
+        width = len(columns)
+        rows = [tuple(row[:width]) + (None,) * (width - len(row)) for row in rows]
+        return pd.DataFrame(rows, columns=columns, index=range(start, start + len(rows)))
+
     def _get_val(self, row, keys, default=None):
         """Helper to get value from multiple potential column names"""
-        for key in keys:
-            if key in row:
-                val = row[key]
-                if isinstance(val, str):
-                    val = val.strip()
-                return val if val else default
-        return default
+        try:
+            pos = self._key_pos[keys]
+        except KeyError:
+            # First alias present in the header wins, same for every row of the frame
+            pos = next((self._col_pos[key] for key in keys if key in self._col_pos), None)
+            self._key_pos[keys] = pos
+
+        if pos is None:
+            return default
+        val = row[pos]
+        if isinstance(val, str):
+            val = val.strip()
+        return val if val else default
+
+    def _prefetch_products(self, refs):
+        """Resolve product references (name, then SKU, case-insensitive) in bulk"""
+        refs = list({str(ref) for ref in refs if ref} - self._products.keys())
+        for start in range(0, len(refs), BULK_BATCH_SIZE):
+            self._resolve_products(refs[start:start + BULK_BATCH_SIZE])
+
+    def _resolve_products(self, refs):
+        # Fold with the database's UPPER so keys agree with the UPPER(name)/UPPER(sku) indexes
+        # One row per reference: a result set is limited to a couple of thousand columns
+        values = ', '.join(['(%s)'] * len(refs))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT column1, UPPER(column1) FROM (VALUES {values}) AS refs', refs)
+            folded = cursor.fetchall()
+        pending = {}
+        for ref, key in folded:
+            pending.setdefault(key, []).append(ref)
+
+        # Same precedence as the old per-row lookups: name before SKU, lowest id first
+        for field in ('name', 'sku'):
+            if not pending:
+                break
+            matches = Product.objects.annotate(ref=Upper(field)).filter(
+                ref__in=list(pending)
+            ).order_by('id').values_list('ref', 'id')
+            for key, product_id in matches:
+                for ref in pending.pop(key, ()):
+                    self._products[ref] = product_id
+
+        for same_refs in pending.values():
+            for ref in same_refs:
+                self._products[ref] = None
+
+    def _get_product_id(self, ref):
+        """Product id for a reference resolved by _prefetch_products"""
+        key = str(ref)
+        if key not in self._products:
+            self._prefetch_products([ref])
+        return self._products[key]
+
+    def _get_aggregator(self, name):
+        """Aggregator by case-insensitive name, looked up once per import"""
+        if not name:
+            return None
+        key = str(name).lower()
+        if key not in self._aggregators:
+            self._aggregators[key] = Aggregator.objects.filter(name__iexact=name).first()
+        return self._aggregators[key]
+
+    def _get_category(self, name):
+        """Category by exact name, created on first use and cached"""
+        category = self._categories.get(name)
+        if category is None:
+            category, _ = Category.objects.get_or_create(name=name)
+            self._categories[name] = category
+        return category
 
     def _process_product(self, row):
-        name = self._get_val(row, ['name', 'название', 'product name', 'товар'])
+        name = self._get_val(row, ('name', 'название', 'product name', 'товар'))
         if not name:
             raise ValueError("Product name is required")
 
-        cat_name = self._get_val(row, ['category', 'категория'])
+        cat_name = self._get_val(row, ('category', 'категория'))
         category = None
         if cat_name:
-            category, _ = Category.objects.get_or_create(name=cat_name)
+            category = self._get_category(cat_name)
 
-        weight_val = self._get_val(row, ['weight_value', 'weight', 'вес', 'объем'])
-        try:
-            weight_val = Decimal(str(weight_val)) if weight_val else None
-        except:
-            weight_val = None
+        weight_val = _to_decimal(self._get_val(row, ('weight_value', 'weight', 'вес', 'объем')))
 
-        Product.objects.update_or_create(
+        self._pending_products[name] = (row, Product(
             name=name,
-            defaults={
-                'category': category,
-                'brand': self._get_val(row, ['brand', 'бренд', 'фирма']),
-                'manufacturer': self._get_val(row, ['manufacturer', 'производитель']),
-                'country_of_origin': self._get_val(row, ['country_of_origin', 'country', 'страна']),
-                'weight_value': weight_val,
-                'weight_unit': self._get_val(row, ['weight_unit', 'unit', 'ед.изм', 'единица']),
-                'sku': self._get_val(row, ['sku', 'артикул', 'код']),
-                'image_url': self._get_val(row, ['image_url', 'image', 'фото', 'изображение']),
-            }
-        )
+            category=category,
+            brand=self._get_val(row, ('brand', 'бренд', 'фирма')),
+            manufacturer=self._get_val(row, ('manufacturer', 'производитель')),
+            country_of_origin=self._get_val(row, ('country_of_origin', 'country', 'страна')),
+            weight_value=weight_val,
+            weight_unit=self._get_val(row, ('weight_unit', 'unit', 'ед.изм', 'единица')),
+            sku=self._get_val(row, ('sku', 'артикул', 'код')),
+            image_url=self._get_val(row, ('image_url', 'image', 'фото', 'изображение')),
+        ))
 
     def _process_price(self, row):
-        prod_ref = self._get_val(row, ['product_name_or_sku', 'product', 'товар', 'name', 'sku'])
+        prod_ref = self._get_val(row, PRICE_PRODUCT_KEYS)
         if not prod_ref:
             raise ValueError("Product reference (name or SKU) is required")
 
-        # Try mapping by exact name or SKU
-        product = Product.objects.filter(name__iexact=prod_ref).first()
-        if not product:
-            product = Product.objects.filter(sku__iexact=prod_ref).first()
-        
-        if not product:
+        # Mapped by exact name or SKU
+        product_id = self._get_product_id(prod_ref)
+        if not product_id:
             raise ValueError(f"Product not found: {prod_ref}")
 
-        agg_name = self._get_val(row, ['aggregator', 'агрегатор', 'магазин'])
+        agg_name = self._get_val(row, ('aggregator', 'агрегатор', 'магазин'))
         if not agg_name:
             raise ValueError("Aggregator name is required")
         
-        aggregator = Aggregator.objects.filter(name__iexact=agg_name).first()
+        aggregator = self._get_aggregator(agg_name)
         if not aggregator:
             raise ValueError(f"Aggregator not found: {agg_name}")
 
-        price_raw = self._get_val(row, ['price', 'цена'])
-        try:
-            price = Decimal(str(price_raw)) if price_raw else None
-        except:
-            price = None
+        price = _to_decimal(self._get_val(row, ('price', 'цена')))
 
-        avail_raw = self._get_val(row, ['is_available', 'available', 'наличие'])
+        avail_raw = self._get_val(row, ('is_available', 'available', 'наличие'))
         is_available = str(avail_raw).lower() in ('true', '1', 'yes', 'да', '+')
 
-        Price.objects.update_or_create(
-            product=product,
+        self._pending_prices[(product_id, aggregator.id)] = (row, Price(
+            product_id=product_id,
             aggregator=aggregator,
-            defaults={
-                'price': price,
-                'is_available': is_available,
-                'competitor_brand': self._get_val(row, ['competitor_brand', 'brand_comp', 'бренд конкурента']),
-                'competitor_country': self._get_val(row, ['competitor_country', 'country_comp', 'страна конкурента']),
-            }
-        )
+            price=price,
+            is_available=is_available,
+            competitor_brand=self._get_val(row, ('competitor_brand', 'brand_comp', 'бренд конкурента')),
+            competitor_country=self._get_val(row, ('competitor_country', 'country_comp', 'страна конкурента')),
+        ))
 
     def _process_link(self, row):
-        prod_ref = self._get_val(row, ['product_name_or_sku', 'product', 'товар', 'name'])
+        prod_ref = self._get_val(row, LINK_PRODUCT_KEYS)
         if not prod_ref:
             raise ValueError("Product reference is required")
 
-        product = Product.objects.filter(name__iexact=prod_ref).first()
-        if not product:
-             # Try loose match or SKU
-            product = Product.objects.filter(sku__iexact=prod_ref).first()
-        
-        if not product:
+        product_id = self._get_product_id(prod_ref)
+        if not product_id:
             raise ValueError(f"Product not found: {prod_ref}")
 
-        agg_name = self._get_val(row, ['aggregator', 'агрегатор'])
-        aggregator = Aggregator.objects.filter(name__iexact=agg_name).first()
+        agg_name = self._get_val(row, ('aggregator', 'агрегатор'))
+        aggregator = self._get_aggregator(agg_name)
         if not aggregator:
              raise ValueError(f"Aggregator not found: {agg_name}")
 
-        ProductLink.objects.update_or_create(
-            product=product,
+        self._pending_links[(product_id, aggregator.id)] = (row, ProductLink(
+            product_id=product_id,
             aggregator=aggregator,
-            defaults={
-                'url': self._get_val(row, ['url', 'link', 'ссылка']),
-                'external_name': self._get_val(row, ['external_name', 'external name', 'название там']),
-            }
-        )
+            url=self._get_val(row, ('url', 'link', 'ссылка')),
+            external_name=self._get_val(row, ('external_name', 'external name', 'название там')),
+        ))
 
     def _process_category(self, row):
-        name = self._get_val(row, ['name', 'название', 'категория'])
+        name = self._get_val(row, ('name', 'название', 'категория'))
         if not name:
             raise ValueError("Category name is required")
         
-        parent_name = self._get_val(row, ['parent_name', 'parent', 'родитель'])
+        parent_name = self._get_val(row, ('parent_name', 'parent', 'родитель'))
         parent = None
         if parent_name:
-            parent, _ = Category.objects.get_or_create(name=parent_name)
+            parent = self._get_category(parent_name)
 
-        Category.objects.update_or_create(
+        self._categories[name], _ = Category.objects.update_or_create(
             name=name,
             defaults={
                 'parent': parent,
-                'icon': self._get_val(row, ['icon', 'иконка']),
-                'sort_order': int(self._get_val(row, ['sort_order', 'order', 'порядок']) or 0)
+                'icon': self._get_val(row, ('icon', 'иконка')),
+                'sort_order': int(self._get_val(row, ('sort_order', 'order', 'порядок')) or 0)
             }
         )
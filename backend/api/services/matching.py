@@ -1,136 +1,117 @@
 from decimal import Decimal
-from ..models import Price, Recommendation, Aggregator
+
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+
+from ..models import Price, Recommendation
+from .dashboard import invalidate_dashboard_stats
+
+# Prices are DecimalFields: keep the whole calculation in Decimal
+CENT = Decimal('0.01')
+UNDERCUT = Decimal('0.99')
+
+# Weight unit -> multiplier to kg/l (pcs are counted as is)
+UNIT_SCALE = {
+    'kg': Decimal(1),
+    'l': Decimal(1),
+    'g': Decimal('0.001'),
+    'ml': Decimal('0.001'),
+    'pcs': Decimal(1),
+}
 
 class ProductMatcher:
-    def __init__(self):
-        self.our_aggregator = Aggregator.objects.filter(is_our_company=True).first()
+    def __init__(self, pending_ids=None):
+        self._pending_ids = pending_ids
+
+    @property
+    def pending_ids(self):
+        """Products that already have a PENDING recommendation, loaded once per matcher"""
+        if self._pending_ids is None:
+            self._pending_ids = set(
+                Recommendation.objects.filter(status='PENDING').values_list('product_id', flat=True)
+            )
+        return self._pending_ids
 
-    def normalize_price(self, product, price_value):
-        """Returns price per kg/l if weight is available, else raw price"""
-        if not price_value or not product.weight_value or not product.weight_unit:
-            return float(price_value)
-        
-        try:
-            val = float(price_value)
-            weight = float(product.weight_value)
-            unit = product.weight_unit.lower()
-
-            if unit == 'kg' or unit == 'l':
-                return val / weight
-            elif unit == 'g' or unit == 'ml':
-                # Price for 1000 units
-                return val / (weight / 1000.0)
-            elif unit == 'pcs':
-                return val / weight
-            return val
-        except:
-            return float(price_value)
-
-    def denormalize_price(self, product, normalized_price):
-        """Converts normalized price back to item price"""
-        if not normalized_price or not product.weight_value or not product.weight_unit:
-            return Decimal(str(normalized_price))
-
-        try:
-            norm_val = float(normalized_price)
-            weight = float(product.weight_value)
-            unit = product.weight_unit.lower()
-
-            item_price = norm_val
-            if unit == 'kg' or unit == 'l':
-                item_price = norm_val * weight
-            elif unit == 'g' or unit == 'ml':
-                item_price = norm_val * (weight / 1000.0)
-            elif unit == 'pcs':
-                item_price = norm_val * weight
-            
-            return Decimal(f"{item_price:.2f}")
-        except:
-             return Decimal(str(normalized_price))
+    def weight_divisor(self, product):
+        """Amount (kg, l or pcs) the item price covers, None if weight is unknown"""
+        if not product.weight_value or not product.weight_unit:
+            return None
+
+        scale = UNIT_SCALE.get(product.weight_unit.lower())
+        if scale is None:
+            return None
+        return product.weight_value * scale
+
+    def _normalize(self, price_value, divisor):
+        if not price_value or not divisor:
+            return price_value
+        return price_value / divisor
+
+    def _denormalize(self, normalized_price, divisor):
+        if not normalized_price or not divisor:
+            return normalized_price.quantize(CENT)
+        return (normalized_price * divisor).quantize(CENT)
 
     def run(self, product):
-        prices = Price.objects.filter(product=product).select_related('aggregator')
+        """Build and save a recommendation for a single product"""
+        recommendations = self.run_batch([product])
+        return recommendations[0] if recommendations else None
+
+    def run_batch(self, products):
+        """Build and bulk-save recommendations for many products, returns the new ones.
+
+        Accepts a Product queryset (streamed in chunks) or a list of products.
+        """
+        # build() only reads these columns
+        prices = Prefetch('price_set', queryset=Price.objects.select_related('aggregator').only(
+            'product', 'price', 'is_available', 'aggregator', 'aggregator__is_our_company'
+        ))
+        if isinstance(products, QuerySet):
+            products = products.select_related('category').prefetch_related(prices).iterator(chunk_size=1000)
+        else:
+            prefetch_related_objects(products, prices)
+
+        recommendations = []
+        for product in products:
+            if product.id in self.pending_ids:
+                continue
+            rec = self.build(product, product.price_set.all())
+            if rec:
+                recommendations.append(rec)
+                self.pending_ids.add(product.id)
+
+        Recommendation.objects.bulk_create(recommendations, batch_size=500)
+        if recommendations:
+            invalidate_dashboard_stats()
+        return recommendations
+
+    def build(self, product, prices):
+        """Unsaved recommendation for a product from its already loaded prices"""
         our_price_obj = None
-        competitor_prices = []
+        # Best competitor by NORMALIZED price, tracked while scanning
+        best_norm = best_raw = None
+        # Weight/unit is per product, resolve it once for all of its prices
+        divisor = self.weight_divisor(product)
 
         for price in prices:
             if price.aggregator.is_our_company:
                 our_price_obj = price
             elif price.is_available and price.price:
-                # Store both raw and normalized for logic
-                competitor_prices.append({
-                    'raw_price': float(price.price),
-                    'normalized_price': self.normalize_price(product, price.price),
-                    'aggregator': price.aggregator.name
-                })
-
-        if not competitor_prices:
+                norm = self._normalize(price.price, divisor)
+                if best_norm is None or norm < best_norm:
+                    best_norm, best_raw = norm, price.price
+
+        if best_norm is None:
             return None
 
-        # Find best competitor by NORMALIZED price
-        # Filter out mismatches if possible?
-        # If we have brand info, prioritize exact matches.
-        
-        valid_competitors = []
-        for comp in competitor_prices:
-            # Logic: If we have specific brand/country info, and they differ significantly, maybe skip?
-            # For now, we will add a 'match_quality' score or just flag it.
-            # But the requirement is to "pick price based on mass/firm".
-            # We already normalize mass.
-            # Firm (Brand):
-            
-            is_brand_mismatch = False
-            if product.brand and comp.get('competitor_brand'):
-                 if product.brand.lower() != comp['competitor_brand'].lower():
-                     is_brand_mismatch = True
-            
-            is_country_mismatch = False
-            if product.country_of_origin and comp.get('competitor_country'):
-                if product.country_of_origin.lower() != comp['competitor_country'].lower():
-                    is_country_mismatch = True
-
-            # Strategy: If mismatch, we only consider them if they are CHEAPER significantly? 
-            # Or we say: If mismatch, we ignore them for "Lower Price" actions?
-            # "1 in KZ vs 1 in DE". DE is likely more expensive. 
-            # If I sell KZ (cheaper) and see DE (market price high), I shouldn't raise my price to DE level?
-            # Actually, standard matching:
-            # If I sell Premium, and Competitor sells Generic -> He is cheaper -> I ignore.
-            # If I sell Generic, and Competitor sells Premium -> He is expensive -> I ignore.
-            
-            # Implementation: If explicit mismatch, skip this price for recommendation calculation.
-            if is_brand_mismatch or is_country_mismatch:
-                continue
-                
-            valid_competitors.append(comp)
-
-        if not valid_competitors:
-             # Fallback: if ALL are mismatched (or no metadata), using raw/all might be better than nothing?
-             # For now, strictly respect the constraint if metadata exists.
-             if competitor_prices and not valid_competitors:
-                 # If we filtered everything out, maybe just take the best one but mark low priority?
-                 # Start with STRICT mode: no valid competitors = no action.
-                 return None
-             return None
-
-        best_competitor = min(valid_competitors, key=lambda x: x['normalized_price'])
-        
         # Check specific strategy for this product category if needed (future proofing)
         # For now, simplistic "beat the best price"
         
         # Determine our normalized price
-        our_raw = float(our_price_obj.price) if (our_price_obj and our_price_obj.price) else None
-        our_norm = self.normalize_price(product, our_price_obj.price) if our_raw else None
-
-        existing = Recommendation.objects.filter(
-            product=product,
-            status='PENDING'
-        ).exists()
-
-        if existing:
-            return None
+        our_raw = our_price_obj.price if (our_price_obj and our_price_obj.price) else None
+        our_norm = self._normalize(our_price_obj.price, divisor) if our_raw else None
 
         # TARGET: Beat them by ~1% or 1 Tinge on normalized scale, then convert back
-        target_norm = best_competitor['normalized_price'] * 0.99 
+        target_norm = best_norm * UNDERCUT
         # Or just match? User said 1g difference logic... 
         # "1 portion 600tg 0.9kg vs 1kg... based on grammage pick price"
         
@@ -139,7 +120,7 @@ class ProductMatcher:
         # My 0.9kg should be < 900tg (1000/kg).
         # Let's say we want to be 1% cheaper per unit.
         
-        target_raw = self.denormalize_price(product, target_norm)
+        target_raw = self._denormalize(target_norm, divisor)
 
         rec = None
 
@@ -150,14 +131,14 @@ class ProductMatcher:
                 action_type='ADD_PRODUCT',
                 current_price=None,
                 recommended_price=target_raw,
-                competitor_price=Decimal(str(best_competitor['raw_price'])),
+                competitor_price=best_raw,
                 priority='HIGH',
                 status='PENDING'
             )
         
-        elif our_norm > best_competitor['normalized_price']:
+        elif our_norm > best_norm:
             # We are more expensive per unit
-            savings = our_raw - float(target_raw)
+            savings = our_raw - target_raw
             priority = 'LOW'
             if savings > 50: priority = 'HIGH'
             elif savings > 10: priority = 'MEDIUM'
@@ -165,15 +146,12 @@ class ProductMatcher:
             rec = Recommendation(
                 product=product,
                 action_type='LOWER_PRICE',
-                current_price=Decimal(str(our_raw)),
+                current_price=our_raw,
                 recommended_price=target_raw,
-                competitor_price=Decimal(str(best_competitor['raw_price'])), # Shows their raw price on shelf
-                potential_savings=Decimal(str(savings)),
+                competitor_price=best_raw, # Shows their raw price on shelf
+                potential_savings=savings,
                 priority=priority,
                 status='PENDING'
             )
-        
-        if rec:
-            rec.save()
-            return rec
-        return None
+
+        return rec
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Aggregator, Price, PriceHistory, Product, Recommendation
+from .services.aggregators import invalidate_our_aggregator_id
+from .services.dashboard import invalidate_dashboard_stats
+from .services.history import invalidate_price_history
+
+
+@receiver([post_save, post_delete], sender=Aggregator)
+def clear_our_aggregator_cache(sender, **kwargs):
+    invalidate_our_aggregator_id()
+
+
+@receiver([post_save, post_delete], sender=Price)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Recommendation)
+def clear_dashboard_cache(sender, **kwargs):
+    invalidate_dashboard_stats()
+
+
+@receiver([post_save, post_delete], sender=PriceHistory)
+def clear_price_history_cache(sender, **kwargs):
+    invalidate_price_history()
@@ -0,0 +1,15 @@
+from django.apps import apps
+from django.test.runner import DiscoverRunner
+
+
+class UnmanagedModelTestRunner(DiscoverRunner):
+    """Test runner that creates tables for the unmanaged models.
+
+    The production tables are not created by migrations, so the test
+    database is built from the models directly (TEST MIGRATE is off).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        for model in apps.get_app_config('api').get_models():
+            model._meta.managed = True
+        super().setup_test_environment(**kwargs)
@@ -1,3 +1,96 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from .models import Aggregator, Product, Price, Recommendation, PriceHistory, ImportJob
+from .services.dashboard import DASHBOARD_CACHE_KEY
+from .services.importer import DataImporter
+
+
+class ApplyBulkTests(APITestCase):
+    url = '/api/recommendations/apply_bulk/'
+
+    def setUp(self):
+        cache.clear()
+        self.ours = Aggregator.objects.create(name='Ours', is_our_company=True)
+        self.competitor = Aggregator.objects.create(name='Glovo')
+        self.milk = Product.objects.create(name='Milk')
+        self.bread = Product.objects.create(name='Bread')
+        Price.objects.create(product=self.milk, aggregator=self.ours, price=Decimal('500.00'))
+        Price.objects.create(product=self.milk, aggregator=self.competitor, price=Decimal('450.00'))
+        Price.objects.create(product=self.bread, aggregator=self.competitor, price=Decimal('120.00'))
+
+        self.lower = Recommendation.objects.create(
+            product=self.milk, action_type='LOWER_PRICE', priority='HIGH',
+            current_price=Decimal('500.00'), recommended_price=Decimal('449.00'),
+        )
+        self.add = Recommendation.objects.create(
+            product=self.bread, action_type='ADD_PRODUCT', priority='MEDIUM',
+            recommended_price=Decimal('119.00'),
+        )
+
+    def test_applies_lower_price_and_add_product(self):
+        response = self.client.post(self.url, {'ids': [self.lower.id, self.add.id]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['applied'], 2)
+
+        milk_price = Price.objects.get(product=self.milk, aggregator=self.ours)
+        self.assertEqual(milk_price.price, Decimal('449.00'))
+        bread_price = Price.objects.get(product=self.bread, aggregator=self.ours)
+        self.assertEqual(bread_price.price, Decimal('119.00'))
+        self.assertTrue(bread_price.is_available)
+
+        history = PriceHistory.objects.get()
+        self.assertEqual(history.product, self.milk)
+        self.assertEqual(history.aggregator, self.ours)
+        self.assertEqual(history.old_price, Decimal('500.00'))
+        self.assertEqual(history.new_price, Decimal('449.00'))
+
+        self.assertEqual(
+            set(Recommendation.objects.values_list('status', flat=True)), {'APPLIED'}
+        )
+
+    def test_dashboard_cache_cleared_after_commit(self):
+        cache.set(DASHBOARD_CACHE_KEY, 'stale')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lower.status = 'REJECTED'
+            self.lower.save(update_fields=['status'])
+            # Still inside the transaction: other requests must not recompute yet
+            self.assertEqual(cache.get(DASHBOARD_CACHE_KEY), 'stale')
+        self.assertIsNone(cache.get(DASHBOARD_CACHE_KEY))
+
+    def test_rejects_invalid_ids(self):
+        for ids in (None, [], ['abc'], [{}]):
+            response = self.client.post(self.url, {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, ids)
+
+        self.assertFalse(Recommendation.objects.filter(status='APPLIED').exists())
+
+
+class PriceImportTests(TestCase):
+    def test_resolves_many_distinct_products(self):
+        # More distinct references than a result set may have columns
+        count = 2500
+        glovo = Aggregator.objects.create(name='Glovo')
+        Product.objects.bulk_create(Product(name=f'Product {i}') for i in range(count))
+        lines = ['product,aggregator,price']
+        lines += [f'product {i},glovo,{i + 1}' for i in range(count)]
+        lines.append('Straße,Glovo,5')
+        Product.objects.create(name='Straße')
+        job = ImportJob.objects.create(job_type='prices', file_name='prices.csv')
+
+        DataImporter(job).process(SimpleUploadedFile('prices.csv', '\n'.join(lines).encode()))
 
-# Create your tests here.
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.success_count, count + 1)
+        self.assertEqual(job.error_count, 0)
+        self.assertEqual(Price.objects.filter(aggregator=glovo).count(), count + 1)
+        self.assertEqual(
+            Price.objects.get(product__name='Product 7', aggregator=glovo).price, Decimal('8.00')
+        )
@@ -18,8 +18,5 @@ urlpatterns = [
     path('price-history/', views.price_history, name='price-history'),
     # Import endpoints
     path('import/template/<str:template_type>/', views.import_template, name='import-template'),
-    path('import/products/', views.import_products, name='import-products'),
-    path('import/prices/', views.import_prices, name='import-prices'),
-    path('import/links/', views.import_links, name='import-links'),
-    path('import/categories/', views.import_categories, name='import-categories'),
+    path('import/<str:job_type>/', views.import_file, name='import-file'),
 ]
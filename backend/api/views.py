@@ -2,15 +2,17 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, action, parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from django.db.models import Count, Sum, Q
+from django.db.models import Count, Min, F, Q, Exists, OuterRef, Subquery
 from django.http import HttpResponse
+from django.db import transaction
 from django.utils import timezone
-from decimal import Decimal
 import csv
 import io
-import pandas as pd
+from openpyxl import Workbook
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
 
-from .models import Aggregator, Category, Product, Price, Recommendation, PriceHistory, ProductLink, ImportJob
+from .models import AlgoRun, Aggregator, Category, Product, Price, Recommendation, PriceHistory, ProductLink, ImportJob
 from .serializers import (
     AggregatorSerializer,
     CategorySerializer,
@@ -19,10 +21,13 @@ from .serializers import (
     ProductComparisonSerializer,
     ProductLinkSerializer,
     RecommendationSerializer,
-    PriceHistorySerializer,
     ImportJobSerializer,
     DashboardSerializer,
+    ApplyBulkSerializer,
 )
+from .services.aggregators import get_our_aggregator_id
+from .services.dashboard import get_dashboard_stats, invalidate_dashboard_stats
+from .services.history import get_recent_price_history, invalidate_price_history
 from .services.importer import DataImporter
 from .services.matching import ProductMatcher
 
@@ -39,8 +44,21 @@ class CategoryViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def tree(self, request):
         """Получить иерархическое дерево категорий"""
-        root_categories = Category.objects.filter(parent__isnull=True).order_by('sort_order', 'name')
-        serializer = CategoryTreeSerializer(root_categories, many=True)
+        # Две выборки на всё дерево вместо запросов на каждый узел
+        children = {}
+        for category in Category.objects.order_by('sort_order', 'name'):
+            children.setdefault(category.parent_id, []).append(category)
+        product_counts = dict(
+            Product.objects.filter(category__isnull=False)
+            .values('category_id').annotate(count=Count('id'))
+            .values_list('category_id', 'count')
+        )
+
+        serializer = CategoryTreeSerializer(
+            children.get(None, []),
+            many=True,
+            context={'children': children, 'product_counts': product_counts}
+        )
         return Response(serializer.data)
 
 
@@ -48,9 +66,18 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.all().select_related('category')
     serializer_class = ProductSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Только колонки, которые отдаёт ProductSerializer
+            queryset = queryset.only('id', 'name', 'image_url', 'category', 'category__name')
+        return queryset
+
     @action(detail=False, methods=['get'])
     def comparison(self, request):
-        products = Product.objects.all().select_related('category')
+        products = ProductComparisonSerializer.setup_eager_loading(
+            Product.objects.all().select_related('category')
+        ).iterator(chunk_size=500)  # цены подгружаются на каждую пачку, а не на весь каталог сразу
         serializer = ProductComparisonSerializer(products, many=True)
         return Response(serializer.data)
 
@@ -59,6 +86,18 @@ class RecommendationViewSet(viewsets.ModelViewSet):
     queryset = Recommendation.objects.all().select_related('product', 'product__category')
     serializer_class = RecommendationSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Из товара и категории нужны только поля, которые показывает RecommendationSerializer
+            queryset = queryset.only(
+                'id', 'product', 'action_type', 'current_price', 'recommended_price',
+                'competitor_price', 'potential_savings', 'priority', 'status', 'created_at',
+                'product__name', 'product__brand', 'product__country_of_origin',
+                'product__category', 'product__category__name'
+            )
+        return queryset
+
     @action(detail=True, methods=['post'])
     def apply(self, request, pk=None):
         recommendation = self.get_object()
@@ -69,166 +108,210 @@ class RecommendationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        our_aggregator = Aggregator.objects.filter(is_our_company=True).first()
-
-        if recommendation.action_type == 'LOWER_PRICE':
-            price_obj = Price.objects.filter(
-                product=recommendation.product,
-                aggregator=our_aggregator
-            ).first()
+        our_aggregator_id = get_our_aggregator_id()
 
-            if price_obj:
-                old_price = price_obj.price
-                price_obj.price = recommendation.recommended_price
-                price_obj.save()
-
-                PriceHistory.objects.create(
+        # Цена, история и статус меняются вместе или не меняются вовсе
+        with transaction.atomic():
+            if recommendation.action_type == 'LOWER_PRICE':
+                price_obj = Price.objects.select_for_update().filter(
+                    product=recommendation.product,
+                    aggregator_id=our_aggregator_id
+                ).first()
+
+                if price_obj:
+                    old_price = price_obj.price
+                    price_obj.price = recommendation.recommended_price
+                    price_obj.save(update_fields=['price', 'last_updated'])
+
+                    PriceHistory.objects.create(
+                        product=recommendation.product,
+                        aggregator_id=our_aggregator_id,
+                        old_price=old_price,
+                        new_price=recommendation.recommended_price
+                    )
+
+            elif recommendation.action_type == 'ADD_PRODUCT':
+                Price.objects.update_or_create(
                     product=recommendation.product,
-                    aggregator=our_aggregator,
-                    old_price=old_price,
-                    new_price=recommendation.recommended_price
+                    aggregator_id=our_aggregator_id,
+                    defaults={
+                        'price': recommendation.recommended_price,
+                        'is_available': True
+                    }
                 )
 
-        elif recommendation.action_type == 'ADD_PRODUCT':
-            Price.objects.update_or_create(
-                product=recommendation.product,
-                aggregator=our_aggregator,
-                defaults={
-                    'price': recommendation.recommended_price,
-                    'is_available': True
-                }
+            recommendation.status = 'APPLIED'
+            recommendation.save(update_fields=['status'])
+
+        return Response({'status': 'success', 'message': 'Recommendation applied'})
+
+    @action(detail=False, methods=['post'])
+    def apply_bulk(self, request):
+        """Применить несколько рекомендаций одним запросом"""
+        serializer = ApplyBulkSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'ids must be a non-empty list of integers'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        ids = serializer.validated_data['ids']
 
-        recommendation.status = 'APPLIED'
-        recommendation.save()
+        our_aggregator_id = get_our_aggregator_id()
+        now = timezone.now()
 
-        return Response({'status': 'success', 'message': 'Recommendation applied'})
+        with transaction.atomic():
+            recommendations = list(
+                Recommendation.objects.select_for_update()
+                .filter(id__in=ids)
+                .exclude(status='APPLIED')
+            )
+            product_ids = [r.product_id for r in recommendations]
+            prices = {
+                p.product_id: p
+                for p in Price.objects.select_for_update().filter(
+                    product_id__in=product_ids,
+                    aggregator_id=our_aggregator_id
+                )
+            }
+
+            changed_prices = {}
+            new_prices = []
+            histories = []
+            for recommendation in recommendations:
+                price_obj = prices.get(recommendation.product_id)
+
+                if recommendation.action_type == 'LOWER_PRICE':
+                    if price_obj:
+                        histories.append(PriceHistory(
+                            product_id=recommendation.product_id,
+                            aggregator_id=our_aggregator_id,
+                            old_price=price_obj.price,
+                            new_price=recommendation.recommended_price
+                        ))
+                        price_obj.price = recommendation.recommended_price
+                        price_obj.last_updated = now
+                        if price_obj.pk:
+                            changed_prices[price_obj.pk] = price_obj
+
+                elif recommendation.action_type == 'ADD_PRODUCT':
+                    if price_obj:
+                        price_obj.price = recommendation.recommended_price
+                        price_obj.is_available = True
+                        price_obj.last_updated = now
+                        if price_obj.pk:
+                            changed_prices[price_obj.pk] = price_obj
+                    else:
+                        price_obj = Price(
+                            product_id=recommendation.product_id,
+                            aggregator_id=our_aggregator_id,
+                            price=recommendation.recommended_price,
+                            is_available=True
+                        )
+                        prices[recommendation.product_id] = price_obj
+                        new_prices.append(price_obj)
+
+            # bulk_update не проставляет auto_now, поэтому last_updated задаём явно
+            Price.objects.bulk_update(
+                changed_prices.values(), ['price', 'is_available', 'last_updated'], batch_size=500
+            )
+            Price.objects.bulk_create(new_prices, batch_size=500)
+            PriceHistory.objects.bulk_create(histories, batch_size=500)
+            applied = Recommendation.objects.filter(
+                id__in=[r.id for r in recommendations]
+            ).update(status='APPLIED')
+
+        invalidate_dashboard_stats()
+        invalidate_price_history()
+        return Response({'status': 'success', 'applied': applied})
 
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         recommendation = self.get_object()
         recommendation.status = 'REJECTED'
-        recommendation.save()
+        recommendation.save(update_fields=['status'])
         return Response({'status': 'success', 'message': 'Recommendation rejected'})
 
 
 @api_view(['GET'])
 def dashboard_stats(request):
-    our_aggregator = Aggregator.objects.filter(is_our_company=True).first()
-    total_products = Product.objects.count()
-
-    products_at_top = 0
-    products_need_action = 0
-    missing_products = 0
-
-    for product in Product.objects.all():
-        prices = Price.objects.filter(product=product).select_related('aggregator')
-        our_price = None
-        competitor_prices = []
-        has_our_product = False
-
-        for price in prices:
-            if price.aggregator.is_our_company:
-                if price.is_available and price.price:
-                    our_price = float(price.price)
-                    has_our_product = True
-            else:
-                if price.is_available and price.price:
-                    competitor_prices.append(float(price.price))
-
-        if not has_our_product:
-            missing_products += 1
-        elif our_price and competitor_prices:
-            min_competitor = min(competitor_prices)
-            # TOP 1 только если СТРОГО меньше
-            if our_price < min_competitor:
-                products_at_top += 1
-            else:
-                # Равная цена или выше = нужно действие
-                products_need_action += 1
-
-    pending_recommendations = Recommendation.objects.filter(status='PENDING').count()
-    potential_savings = Recommendation.objects.filter(
-        status='PENDING',
-        potential_savings__isnull=False
-    ).aggregate(total=Sum('potential_savings'))['total'] or Decimal('0')
-
-    market_coverage = ((total_products - missing_products) / total_products * 100) if total_products > 0 else 0
-    price_competitiveness = (products_at_top / (total_products - missing_products) * 100) if (total_products - missing_products) > 0 else 0
-
-    data = {
-        'total_products': total_products,
-        'products_at_top': products_at_top,
-        'products_need_action': products_need_action,
-        'missing_products': missing_products,
-        'pending_recommendations': pending_recommendations,
-        'potential_savings': potential_savings,
-        'market_coverage': round(market_coverage, 1),
-        'price_competitiveness': round(price_competitiveness, 1)
-    }
-
-    return Response(data)
+    return Response(get_dashboard_stats())
 
 
 @api_view(['GET'])
 def analytics_gaps(request):
     """Get products that we don't have but competitors do"""
-    our_aggregator = Aggregator.objects.filter(is_our_company=True).first()
-
-    gaps = []
-    for product in Product.objects.all().select_related('category'):
-        our_price = Price.objects.filter(
-            product=product,
-            aggregator=our_aggregator
-        ).first()
-
-        if not our_price or not our_price.is_available or not our_price.price:
-            competitor_prices = Price.objects.filter(
-                product=product,
-                is_available=True
-            ).exclude(aggregator=our_aggregator).exclude(price__isnull=True)
-
-            if competitor_prices.exists():
-                min_price = min(float(p.price) for p in competitor_prices)
-                gaps.append({
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'category': product.category.name if product.category else None,
-                    'min_competitor_price': min_price,
-                    'suggested_price': round(min_price - 1, 2)
-                })
+    our_aggregator_id = get_our_aggregator_id()
+
+    our_price_available = Price.objects.filter(
+        product=OuterRef('pk'),
+        aggregator_id=our_aggregator_id,
+        is_available=True,
+        price__isnull=False
+    ).exclude(price=0)
+    min_competitor_price = Price.objects.filter(
+        product=OuterRef('pk'),
+        is_available=True,
+        price__isnull=False
+    ).exclude(aggregator_id=our_aggregator_id).values('product').annotate(
+        min_price=Min('price')
+    ).values('min_price')
+
+    rows = Product.objects.annotate(
+        our_available=Exists(our_price_available),
+        min_competitor_price=Subquery(min_competitor_price)
+    ).filter(
+        our_available=False,
+        min_competitor_price__isnull=False
+    ).annotate(
+        suggested_price=F('min_competitor_price') - 1
+    ).values('id', 'name', 'category__name', 'min_competitor_price', 'suggested_price')
+
+    gaps = [
+        {
+            'product_id': row['id'],
+            'product_name': row['name'],
+            'category': row['category__name'],
+            'min_competitor_price': float(row['min_competitor_price']),
+            'suggested_price': float(row['suggested_price'])
+        }
+        for row in rows
+    ]
 
     return Response(gaps)
 
 
 @api_view(['POST'])
 def run_algorithm(request):
-    """Run the pricing optimization algorithm"""
-    our_aggregator = Aggregator.objects.filter(is_our_company=True).first()
-
-    new_recommendations = []
-
-    matcher = ProductMatcher()
-    count = 0
+    """Run the pricing optimization algorithm.
+
+    With {"changed_only": true} only products whose prices changed since the
+    previous run are swept.
+    """
+    products = Product.objects.all()
+    # Taken before reading prices so changes made during the run are picked up next time
+    watermark = timezone.now()
+
+    if request.data.get('changed_only'):
+        last_run = AlgoRun.objects.order_by('-watermark').first()
+        if last_run:
+            products = products.filter(
+                id__in=Price.objects.filter(last_updated__gt=last_run.watermark).values('product_id')
+            )
 
-    for product in Product.objects.all():
-        rec = matcher.run(product)
-        if rec:
-            new_recommendations.append(RecommendationSerializer(rec).data)
-            count += 1
+    with transaction.atomic():
+        new_recommendations = ProductMatcher().run_batch(products)
+        AlgoRun.objects.create(watermark=watermark, new_recommendations=len(new_recommendations))
 
     return Response({
         'status': 'success',
-        'new_recommendations': count,
-        'recommendations': new_recommendations
+        'new_recommendations': len(new_recommendations),
+        'recommendations': RecommendationSerializer(new_recommendations, many=True).data
     })
 
 
 @api_view(['GET'])
 def price_history(request):
-    history = PriceHistory.objects.all().select_related('product', 'aggregator').order_by('-changed_at')[:50]
-    serializer = PriceHistorySerializer(history, many=True)
-    return Response(serializer.data)
+    return Response(get_recent_price_history())
 
 
 class ProductLinkViewSet(viewsets.ModelViewSet):
@@ -262,9 +345,6 @@ def import_template(request, template_type):
     if template_type not in templates:
         return Response({'error': 'Unknown template type'}, status=400)
 
-    # create DataFrame
-    df = pd.DataFrame(columns=templates[template_type])
-
     # Add examples
     examples = {
         'products': [{
@@ -300,27 +380,30 @@ def import_template(request, template_type):
         }],
     }
     
-    if template_type in examples:
-        df = pd.concat([df, pd.DataFrame(examples[template_type])], ignore_index=True)
+    columns = templates[template_type]
+    rows = [[example.get(col) if example.get(col) != '' else None for col in columns]
+            for example in examples.get(template_type, [])]
 
     # Write to Excel
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Template'
+    worksheet.append(columns)
+    for cell in worksheet[1]:
+        cell.font = Font(bold=True)
+    for row in rows:
+        worksheet.append(row)
+
+    # Adjust column widths for better UX
+    for idx, col in enumerate(columns, start=1):
+        lengths = [len(str(col))] + [len(str(row[idx - 1])) for row in rows if row[idx - 1] is not None]
+        worksheet.column_dimensions[get_column_letter(idx)].width = min(max(lengths) + 2, 50)
+
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Template')
-        
-        # Adjust column widths for better UX
-        worksheet = writer.sheets['Template']
-        for idx, col in enumerate(df.columns):
-            max_len = max(
-                df[col].astype(str).map(len).max(),
-                len(str(col))
-            ) + 2
-            worksheet.column_dimensions[chr(65 + idx)].width = min(max_len, 50)
-
-    output.seek(0)
-    
+    workbook.save(output)
+
     response = HttpResponse(
-        output.read(),
+        output.getvalue(),
         content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
     response['Content-Disposition'] = f'attachment; filename="{template_type}_template.xlsx"'
@@ -329,101 +412,23 @@ def import_template(request, template_type):
 
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
-def import_products(request):
-    """Импорт товаров из CSV/Excel"""
-    file = request.FILES.get('file')
-    if not file:
-        return Response({'error': 'No file provided'}, status=400)
-
-    job = ImportJob.objects.create(
-        job_type='products',
-        file_name=file.name,
-        status='processing'
-    )
-
-    importer = DataImporter(job)
-    # Run in background ideally, but synchronous for now as in original
-    importer.process(file)
-
-    return Response({
-        'job_id': job.id,
-        'status': job.status,
-        'total': job.total_rows,
-        'success': job.success_count,
-        'errors': job.error_count,
-        'error_details': job.error_details
-    })
-
-
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def import_prices(request):
-    """Импорт цен из CSV/Excel"""
-    file = request.FILES.get('file')
-    if not file:
-        return Response({'error': 'No file provided'}, status=400)
-
-    job = ImportJob.objects.create(
-        job_type='prices',
-        file_name=file.name,
-        status='processing'
-    )
-
-    importer = DataImporter(job)
-    importer.process(file)
-
-    return Response({
-        'job_id': job.id,
-        'status': job.status,
-        'total': job.total_rows,
-        'success': job.success_count,
-        'errors': job.error_count,
-        'error_details': job.error_details
-    })
-
-
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def import_links(request):
-    """Импорт ссылок из CSV/Excel"""
-    file = request.FILES.get('file')
-    if not file:
-        return Response({'error': 'No file provided'}, status=400)
-
-    job = ImportJob.objects.create(
-        job_type='links',
-        file_name=file.name,
-        status='processing'
-    )
-
-    importer = DataImporter(job)
-    importer.process(file)
+def import_file(request, job_type):
+    """Импорт товаров, цен, ссылок или категорий из CSV/Excel"""
+    if job_type not in dict(ImportJob.JOB_TYPES):
+        return Response({'error': 'Unknown import type'}, status=400)
 
-    return Response({
-        'job_id': job.id,
-        'status': job.status,
-        'total': job.total_rows,
-        'success': job.success_count,
-        'errors': job.error_count,
-        'error_details': job.error_details
-    })
-
-
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def import_categories(request):
-    """Импорт категорий из CSV/Excel"""
     file = request.FILES.get('file')
     if not file:
         return Response({'error': 'No file provided'}, status=400)
 
     job = ImportJob.objects.create(
-        job_type='categories',
+        job_type=job_type,
         file_name=file.name,
         status='processing'
     )
 
     importer = DataImporter(job)
+    # Run in background ideally, but synchronous for now as in original
     importer.process(file)
 
     return Response({